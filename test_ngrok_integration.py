@@ -8,13 +8,17 @@ import subprocess
 import sys
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 
 def test_edge_server_with_ngrok():
     """Test the edge server with ngrok public HTTP URL"""
 
-    print("=== Edge Server ngrok Integration Test ===\n")
+    # The header is collected and printed in one write before the probe
+    log = ["=== Edge Server ngrok Integration Test ===\n"]
 
     # Configuration
     DEVICE_ID = "test_device_001"
@@ -22,65 +26,101 @@ def test_edge_server_with_ngrok():
     # Replace with actual ngrok URL
     EDGE_NGROK_URL = "https://YOUR_EDGE_NGROK_URL.ngrok.io"
     HTTP_PORT = 8081
+    # Backend endpoints checked for reachability
+    HEALTH_ENDPOINTS = ["/health", "/api/test", "/api/devices"]
 
-    print(f"Device ID: {DEVICE_ID}")
-    print(f"Backend API URL: {BACKEND_API_URL}")
-    print(f"Edge Server ngrok URL: {EDGE_NGROK_URL}")
-    print(f"HTTP Port: {HTTP_PORT}")
-    print()
+    log.append(f"Device ID: {DEVICE_ID}")
+    log.append(f"Backend API URL: {BACKEND_API_URL}")
+    log.append(f"Edge Server ngrok URL: {EDGE_NGROK_URL}")
+    log.append(f"HTTP Port: {HTTP_PORT}")
+    log.append("")
 
     # Test 1: Verify backend is accessible
-    print("1. Testing backend API accessibility...")
+    log.append("1. Testing backend API accessibility...")
+    print('\n'.join(log), flush=True)
+
+    # Probe results and the remaining steps are written together at the end,
+    # also when a step raises
+    log = []
     try:
-        response = requests.get(f"{BACKEND_API_URL}/api/devices", timeout=10)
-        print(f"   ✓ Backend API accessible: {response.status_code}")
-    except Exception as e:
-        print(f"   ✗ Backend API error: {e}")
-        return False
-
-    # Test 2: Show how to start edge server with ngrok
-    print("\n2. Edge server command with ngrok support:")
-    command = [
-        "python", "edgeServer/edge_server.py",
-        "--device-id", DEVICE_ID,
-        "--api-url", BACKEND_API_URL,
-        "--public-http-url", EDGE_NGROK_URL,
-        "--http-port", str(HTTP_PORT)
-    ]
-    print(f"   Command: {' '.join(command)}")
-
-    # Test 3: Show expected registration payload
-    print("\n3. Expected registration payload:")
-    server_info = {
-        "host": "localhost",
-        "port": 8080,  # WebSocket port
-        "http_port": HTTP_PORT,
-        "public_http_url": EDGE_NGROK_URL
-    }
-    print(f"   server_info: {json.dumps(server_info, indent=2)}")
-
-    # Test 4: Manual ngrok setup instructions
-    print("\n4. Manual ngrok setup steps:")
-    print("   a. Install ngrok: https://ngrok.com/download")
-    print("   b. Authenticate: ngrok config add-authtoken YOUR_TOKEN")
-    print(f"   c. Start tunnel: ngrok http {HTTP_PORT}")
-    print("   d. Copy the https URL (e.g., https://abc123.ngrok.io)")
-    print("   e. Update EDGE_NGROK_URL in this script")
-    print("   f. Run edge server with --public-http-url parameter")
-
-    # Test 5: Expected backend behavior
-    print("\n5. Expected backend behavior:")
-    print("   - Device registration includes public_http_url in server_info")
-    print("   - Backend HTTP API requests use public URL when available")
-    print("   - Falls back to local IP if public URL not available")
-    print("   - File operations and terminal commands work through ngrok tunnel")
-
-    print("\n=== Test Complete ===")
-    print("To run the actual edge server with ngrok, execute:")
-    print(
-        f"python edgeServer/edge_server.py --device-id {DEVICE_ID} --api-url {BACKEND_API_URL} --public-http-url {EDGE_NGROK_URL} --http-port {HTTP_PORT}")
-
-    return True
+        # Reuse one keep-alive connection pool for every backend request
+        with requests.Session() as session:
+            # Retry transient connect failures on the pooled connection instead
+            # of failing the whole probe
+            adapter = HTTPAdapter(
+                pool_connections=4, pool_maxsize=16,
+                max_retries=Retry(total=2, backoff_factor=0.2))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            def probe(path):
+                # HEAD: only the status matters, so skip the response body
+                try:
+                    return path, session.head(
+                        f"{BACKEND_API_URL}{path}", timeout=10, allow_redirects=True)
+                except Exception as e:
+                    return path, e
+
+            # Check all endpoints concurrently over the shared pool
+            with ThreadPoolExecutor(max_workers=len(HEALTH_ENDPOINTS)) as executor:
+                results = list(executor.map(probe, HEALTH_ENDPOINTS))
+
+        reachable = True
+        for path, result in results:
+            if isinstance(result, Exception):
+                log.append(f"   ✗ Backend API error ({path}): {result}")
+                reachable = False
+            else:
+                log.append(f"   ✓ Backend API accessible ({path}): {result.status_code}")
+        if not reachable:
+            return False
+
+        # Test 2: Show how to start edge server with ngrok
+        log.append("\n2. Edge server command with ngrok support:")
+        command = [
+            "python", "edgeServer/edge_server.py",
+            "--device-id", DEVICE_ID,
+            "--api-url", BACKEND_API_URL,
+            "--public-http-url", EDGE_NGROK_URL,
+            "--http-port", str(HTTP_PORT)
+        ]
+        log.append(f"   Command: {' '.join(command)}")
+
+        # Test 3: Show expected registration payload
+        log.append("\n3. Expected registration payload:")
+        server_info = {
+            "host": "localhost",
+            "port": 8080,  # WebSocket port
+            "http_port": HTTP_PORT,
+            "public_http_url": EDGE_NGROK_URL
+        }
+        log.append(f"   server_info: {json.dumps(server_info, indent=2)}")
+
+        # Test 4: Manual ngrok setup instructions
+        log.append("\n4. Manual ngrok setup steps:")
+        log.append("   a. Install ngrok: https://ngrok.com/download")
+        log.append("   b. Authenticate: ngrok config add-authtoken YOUR_TOKEN")
+        log.append(f"   c. Start tunnel: ngrok http {HTTP_PORT}")
+        log.append("   d. Copy the https URL (e.g., https://abc123.ngrok.io)")
+        log.append("   e. Update EDGE_NGROK_URL in this script")
+        log.append("   f. Run edge server with --public-http-url parameter")
+
+        # Test 5: Expected backend behavior
+        log.append("\n5. Expected backend behavior:")
+        log.append("   - Device registration includes public_http_url in server_info")
+        log.append("   - Backend HTTP API requests use public URL when available")
+        log.append("   - Falls back to local IP if public URL not available")
+        log.append("   - File operations and terminal commands work through ngrok tunnel")
+
+        log.append("\n=== Test Complete ===")
+        log.append("To run the actual edge server with ngrok, execute:")
+        log.append(
+            f"python edgeServer/edge_server.py --device-id {DEVICE_ID} --api-url {BACKEND_API_URL} --public-http-url {EDGE_NGROK_URL} --http-port {HTTP_PORT}")
+
+        return True
+    finally:
+        if log:
+            print('\n'.join(log))
 
 
 if __name__ == "__main__":
@@ -8,15 +8,86 @@ import os
 import time
 import subprocess
 import pty
-import select
+import re
+import selectors
+import shlex
+import signal
+import threading
 import uuid
 
+# Blank lines and shell prompt lines ("user@host:~$") in raw PTY output
+_PROMPT_RE = re.compile(rb'(?m)^(?:[^\n]*\$)?[ \t\r]*(?:\n|\Z)')
+
+
+def _exit_code(status):
+    """Decode a waitpid status the way Popen.returncode does"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _wait_for_exit(proc, timeout):
+    """proc.wait(timeout), blocking in one epoll_wait on a pidfd where available"""
+    if proc.poll() is None and hasattr(os, 'pidfd_open'):
+        try:
+            pidfd = os.pidfd_open(proc.pid)
+        except OSError:
+            pidfd = None  # Kernel without pidfd support, or already gone
+        if pidfd is not None:
+            # Wake once when the pidfd reports exit or time runs out; the
+            # zero-timeout wait then reaps or raises TimeoutExpired
+            try:
+                with selectors.DefaultSelector() as sel:
+                    sel.register(pidfd, selectors.EVENT_READ)
+                    sel.select(timeout)
+            finally:
+                os.close(pidfd)
+            return proc.wait(timeout=0)
+    return proc.wait(timeout=timeout)
+
+
+class Session:
+    """A bash process attached to the slave side of a PTY"""
+
+    __slots__ = ('proc', 'master_fd', 'sel')
+
+    def __init__(self, proc, master_fd):
+        self.proc = proc
+        self.master_fd = master_fd
+        # Selector watching only this PTY, so a read never wakes for (or
+        # has to buffer) output of other sessions
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(master_fd, selectors.EVENT_READ)
+
 
 class TerminalManager:
     """Terminal session management with PTY support"""
 
-    def __init__(self):
-        self.sessions = {}  # session_id -> (process, master_fd)
+    def __init__(self, pool_size=0):
+        self.sessions = {}  # session_id -> Session
+        # Scratch buffer reused by every read from a PTY master (as a
+        # one-element readv vector). Linux returns at most 4095 bytes per
+        # PTY read, so one buffer is already more than a read can fill.
+        self._readbufs = [bytearray(65536)]
+        # Shells reaped by the SIGCHLD handler, so liveness is a set lookup
+        self._dead: set[str] = set()
+        self._pid_to_session: dict[int, str] = {}
+        try:
+            self._prev_sigchld = signal.signal(signal.SIGCHLD, self._on_sigchld)
+            self._watch_children = True
+        except ValueError:
+            # Handlers can only be installed from the main thread
+            self._watch_children = False
+        # Fresh shells (with their pending readiness tag) spawned ahead of
+        # create_session by a background thread. Off unless pool_size is set;
+        # filling starts after the first create_session has its shell ready.
+        self._pool: list[tuple[Session, bytes]] = []
+        self._pool_target = pool_size
+        self._pool_lock = threading.Lock()
+        self._pool_wanted = threading.Event()
+        self._closed = False
+        if pool_size:
+            threading.Thread(target=self._refill_pool, daemon=True).start()
 
     def create_session(self, session_id=None):
         """Create a new terminal session with PTY"""
@@ -28,28 +99,26 @@ class TerminalManager:
             self.close_session(session_id)
 
         try:
-            # Create PTY pair
-            master_fd, slave_fd = pty.openpty()
-
-            # Create bash process with PTY
-            process = subprocess.Popen(
-                ['/bin/bash', '-i'],  # Interactive bash
-                stdin=slave_fd,
-                stdout=slave_fd,
-                stderr=slave_fd,
-                close_fds=True,
-                preexec_fn=os.setsid  # Create new session
-            )
-
-            # Close slave fd in parent process
-            os.close(slave_fd)
+            # Use a pre-warmed shell when one is ready, else start one now
+            shell = self._take_pooled_shell() or self._spawn_shell()
+            sess, ready_tag = shell
 
             # Store session info
-            self.sessions[session_id] = (process, master_fd)
+            self.sessions[session_id] = sess
+            self._pid_to_session[sess.proc.pid] = session_id
+            # The shell may have exited before its pid was known
+            self._reap_children()
             print(f"Created PTY terminal session: {session_id}")
 
-            # Wait a bit for the shell to initialize
-            time.sleep(0.1)
+            # Wait until the shell is reading input, then discard its banner.
+            # For pooled shells the reply is usually already buffered.
+            if not self._read_until(sess, bytearray(), ready_tag, 1, 2.0):
+                print(f"Terminal session {session_id} not ready after 2.0s; "
+                      f"the first command will wait for shell startup")
+
+            # Refill only now, so pool spawns don't compete with this shell
+            if self._pool_target:
+                self._pool_wanted.set()
 
             return session_id
 
@@ -57,6 +126,74 @@ class TerminalManager:
             print(f"Failed to create terminal session: {str(e)}")
             raise
 
+    def _spawn_shell(self):
+        """Start bash on a new PTY and send it a readiness probe
+
+        Returns the session and the tag its probe will print. Touches no
+        manager state, so the pool thread can call it.
+        """
+        # Create PTY pair
+        master_fd, slave_fd = pty.openpty()
+
+        # Create bash process with PTY. Without a preexec_fn, Popen execs
+        # straight from a vfork()ed child (CPython 3.10+) with setsid, every
+        # signal back at its default and extra fds closed via close_range
+        args = ['/bin/bash', '-i']  # Interactive bash
+        try:
+            process = subprocess.Popen(
+                args, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                start_new_session=True  # Create new session
+            )
+        except OSError:
+            os.close(master_fd)
+            raise
+        finally:
+            # Close slave fd in parent process
+            os.close(slave_fd)
+
+        # Non-blocking master so reads can drain until EAGAIN
+        os.set_blocking(master_fd, False)
+
+        # Queue the probe now; the shell answers once it is reading input
+        marker = uuid.uuid4().hex
+        os.write(master_fd, f"printf '<%s>\\n' {marker}\n".encode())
+
+        return Session(process, master_fd), f'<{marker}>'.encode()
+
+    def _take_pooled_shell(self):
+        """Pop a live pre-warmed shell from the pool, or None if it is empty"""
+        if not self._pool_target:
+            return None
+        while True:
+            with self._pool_lock:
+                if not self._pool:
+                    shell = None
+                    break
+                shell = self._pool.pop()
+            if shell[0].proc.poll() is None:
+                break
+            self._close_shell(shell[0])
+        return shell
+
+    def _refill_pool(self):
+        """Pool thread: keep _pool_target fresh shells spawned ahead of use"""
+        while True:
+            self._pool_wanted.wait()
+            self._pool_wanted.clear()
+            while not self._closed and len(self._pool) < self._pool_target:
+                try:
+                    shell = self._spawn_shell()
+                except OSError as e:
+                    print(f"Failed to pre-spawn terminal shell: {str(e)}")
+                    break
+                with self._pool_lock:
+                    if not self._closed:
+                        self._pool.append(shell)
+                        continue
+                self._close_shell(shell[0])
+            if self._closed:
+                return
+
     def execute_command(self, session_id, command, timeout=5):
         """Execute command in terminal session"""
         try:
@@ -66,66 +203,67 @@ class TerminalManager:
                     'error': 'Terminal session not found'
                 }
 
-            process, master_fd = self.sessions[session_id]
+            sess = self.sessions[session_id]
+            process, master_fd = sess.proc, sess.master_fd
 
-            # Check if process is still running
-            if process.poll() is not None:
+            # Check if process is still running and its PTY still open
+            if self._watch_children:
+                ended = session_id in self._dead
+            else:
+                ended = process.poll() is not None
+            if ended or not sess.sel.get_map():
                 return {
                     'success': False,
                     'error': 'Terminal session has ended'
                 }
 
-            # Send command to PTY
+            # Wrap the command in sentinel lines so the read can stop as soon
+            # as it finishes. printf keeps the literal "<marker>" out of the
+            # terminal's echo of the input line.
+            marker = uuid.uuid4().hex
+            tag = f'<{marker}>'.encode()
+            quoted = shlex.quote(command).encode('utf-8')
+
+            # Send command to PTY; writev avoids joining the wrapper parts
             try:
-                command_bytes = (command + '\n').encode('utf-8')
-                os.write(master_fd, command_bytes)
+                # eval runs the quoted command as its own input, so trailing
+                # ';' or '&', comments and newlines cannot break the wrapper
+                os.writev(master_fd, [
+                    f"printf '<%s>\\n' {marker}; eval ".encode(),
+                    quoted,
+                    f"; printf '<%s>\\n' {marker}\n".encode(),
+                ])
             except Exception as e:
                 return {
                     'success': False,
                     'error': f'Failed to write command: {str(e)}'
                 }
 
-            # Read output with timeout using select
-            output_parts = []
-            end_time = time.time() + timeout
-
-            while time.time() < end_time:
-                # Use select to check if data is available
-                rlist, _, _ = select.select([master_fd], [], [], 0.1)
-
-                if master_fd in rlist:
-                    try:
-                        # Read available data
-                        data = os.read(master_fd, 4096).decode(
-                            'utf-8', errors='replace')
-                        if data:
-                            output_parts.append(data)
-                        else:
-                            break
-                    except (OSError, UnicodeDecodeError) as e:
-                        print(f"Error reading from PTY: {str(e)}")
-                        break
-                elif not rlist:
-                    # No data available, continue polling
-                    continue
-                else:
-                    break
-
-            # Join all output parts
-            full_output = ''.join(output_parts)
-
-            # Clean up the output (remove command echo and prompts)
-            lines = full_output.split('\n')
-            cleaned_lines = []
-
-            for line in lines:
-                # Skip empty lines and command echoes
-                line = line.strip()
-                if line and not line.endswith('$') and line != command.strip():
-                    cleaned_lines.append(line)
-
-            cleaned_output = '\n'.join(
-                cleaned_lines) if cleaned_lines else full_output.strip()
+            buf = bytearray()
+            self._read_until(sess, buf, tag, 2, timeout)
+
+            start = buf.find(tag)
+            if start >= 0:
+                # Everything after the first sentinel is command output; the
+                # second one is missing only if the command timed out
+                start += len(tag)
+                end = buf.find(tag, start)
+                if end < 0:
+                    end = len(buf)
+                # Decode through a view so the slice is not copied first
+                cleaned_output = str(memoryview(buf)[start:end], 'utf-8', 'replace')
+                cleaned_output = cleaned_output.replace('\r\n', '\n').strip()
+            else:
+                # The wrapper never ran: fall back to scrubbing the raw
+                # output of prompts and the echo of the wrapper line, which
+                # is every line carrying the marker
+                echo_re = re.compile(
+                    rb'(?m)^[^\n]*' + marker.encode() + rb'[^\n]*(?:\n|\Z)')
+                echoless = echo_re.sub(b'', buf)
+                cleaned_output = _PROMPT_RE.sub(b'', echoless).decode(
+                    'utf-8', errors='replace').replace('\r\n', '\n').strip()
+                if not cleaned_output:
+                    cleaned_output = echoless.decode('utf-8', errors='replace').strip()
 
             return {
                 'success': True,
@@ -142,27 +280,141 @@ class TerminalManager:
                 'error': str(e)
             }
 
+    def _read_until(self, sess, buf, tag, count, timeout):
+        """Read PTY output into buf until tag has been seen count times
+
+        Returns True if it was, False on timeout or when the PTY closed.
+        """
+        # Integer monotonic deadline; hot-loop callables bound to locals
+        clock = time.monotonic_ns
+        select = sess.sel.select
+        drain = self._drain
+        deadline_ns = clock() + int(timeout * 1e9)
+        now = clock()
+        # Sentinels found so far and where the next search starts, so each
+        # byte is scanned once instead of recounting the whole buffer
+        found = 0
+        scan = 0
+        closed = False
+
+        while True:
+            while found < count:
+                i = buf.find(tag, scan)
+                if i < 0:
+                    # A sentinel may straddle the end of what has arrived
+                    scan = max(scan, len(buf) - len(tag) + 1)
+                    break
+                found += 1
+                scan = i + len(tag)
+            if found >= count or closed or now >= deadline_ns:
+                return found >= count
+
+            # Block until the PTY is readable or the deadline passes
+            if select(timeout=(deadline_ns - now) / 1e9):
+                closed = not drain(sess.master_fd, buf)
+            if closed:
+                # Scan what the last drain read, then stop
+                sess.sel.unregister(sess.master_fd)
+            now = clock()
+
+    def _drain(self, master_fd, buf):
+        """Read all available PTY output into buf; False once the PTY is closed"""
+        while True:
+            try:
+                n = os.readv(master_fd, self._readbufs)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                # EIO is raised once the shell side of the PTY has gone away
+                print(f"Error reading from PTY: {str(e)}")
+                return False
+            if not n:
+                return False
+            chunk = self._readbufs[0]
+            buf += memoryview(chunk)[:n]
+            # A short read does not mean the PTY is empty: each read is
+            # capped at 4095 bytes. Returning anyway trades the read that
+            # usually fails with EAGAIN for one epoll_wait, which reports
+            # the fd again at once if more output is queued.
+            if n < len(chunk):
+                return True
+
+    def _on_sigchld(self, signum, frame):
+        """SIGCHLD handler: reap exited shells, then chain any previous handler"""
+        self._reap_children()
+        if callable(self._prev_sigchld):
+            self._prev_sigchld(signum, frame)
+
+    def _reap_children(self):
+        """Reap exited session shells and mark their sessions dead"""
+        for pid, session_id in list(self._pid_to_session.items()):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, 0  # Already reaped elsewhere
+            if done:
+                self._pid_to_session.pop(pid, None)
+                self._dead.add(session_id)
+                sess = self.sessions.get(session_id)
+                if sess and sess.proc.returncode is None:
+                    sess.proc.returncode = _exit_code(status)
+
+    def _close_shell(self, sess, reaped=False):
+        """Close a shell's PTY master and terminate the shell if still running"""
+        # Stop watching the fd before closing it
+        sess.sel.close()
+
+        # Close master fd
+        try:
+            os.close(sess.master_fd)
+        except OSError:
+            pass  # Already closed
+
+        if not reaped:
+            try:
+                sess.proc.terminate()
+                _wait_for_exit(sess.proc, 2)
+            except subprocess.TimeoutExpired:
+                sess.proc.kill()
+                sess.proc.wait()
+            except ProcessLookupError:
+                pass  # Process already dead
+
+    def shutdown(self):
+        """Close all sessions and pooled shells and stop refilling the pool"""
+        with self._pool_lock:
+            self._closed = True
+            pool, self._pool = self._pool, []
+        self._pool_wanted.set()
+        for sess, _ in pool:
+            self._close_shell(sess)
+        for session_id in list(self.sessions):
+            self.close_session(session_id)
+
+        # Put back the SIGCHLD handler we replaced, unless someone else has
+        # installed theirs since
+        if self._watch_children:
+            self._watch_children = False
+            try:
+                if signal.getsignal(signal.SIGCHLD) == self._on_sigchld:
+                    prev = self._prev_sigchld
+                    signal.signal(signal.SIGCHLD,
+                                  signal.SIG_DFL if prev is None else prev)
+            except ValueError:
+                pass  # Not on the main thread; the handler stays installed
+
     def close_session(self, session_id):
         """Close terminal session"""
         try:
             if session_id in self.sessions:
-                process, master_fd = self.sessions.pop(session_id)
+                sess = self.sessions.pop(session_id)
+                process = sess.proc
 
-                # Close master fd
-                try:
-                    os.close(master_fd)
-                except OSError:
-                    pass  # Already closed
-
-                # Terminate process
-                try:
-                    process.terminate()
-                    process.wait(timeout=2)
-                except subprocess.TimeoutExpired:
-                    process.kill()
-                    process.wait()
-                except ProcessLookupError:
-                    pass  # Process already dead
+                # Terminate process unless the SIGCHLD handler already reaped it
+                self._pid_to_session.pop(process.pid, None)
+                reaped = session_id in self._dead
+                self._dead.discard(session_id)
+                self._close_shell(sess, reaped)
 
                 print(f"Closed terminal session: {session_id}")
                 return True
@@ -172,56 +424,74 @@ class TerminalManager:
             return False
 
 
+def _flush(lines):
+    """Print pending report lines with one write and empty the list"""
+    if lines:
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
+        lines.clear()
+
+
 def test_terminal_manager():
     """Test the TerminalManager functionality"""
-    print("🧪 Testing TerminalManager with PTY support...")
-
-    tm = TerminalManager()
-
-    # Test 1: Create session
-    print("\n1. Creating terminal session...")
-    session_id = tm.create_session()
-    print(f"   Session created: {session_id}")
-
-    # Test 2: Simple command
-    print("\n2. Testing simple command (ls)...")
-    result = tm.execute_command(session_id, 'ls')
-    print(f"   Success: {result['success']}")
-    if result['success']:
-        print(f"   Output: {result['stdout'][:200]}...")
-    else:
-        print(f"   Error: {result['error']}")
-
-    # Test 3: Change directory
-    print("\n3. Testing cd command...")
-    result = tm.execute_command(session_id, 'cd ~')
-    print(f"   Success: {result['success']}")
-
-    # Test 4: Check if cd persisted
-    print("\n4. Testing pwd after cd...")
-    result = tm.execute_command(session_id, 'pwd')
-    print(f"   Success: {result['success']}")
-    if result['success']:
-        print(f"   Current directory: {result['stdout']}")
-    else:
-        print(f"   Error: {result['error']}")
-
-    # Test 5: Environment variable
-    print("\n5. Testing environment variable...")
-    result = tm.execute_command(session_id, 'export TEST_VAR=hello')
-    print(f"   Set variable - Success: {result['success']}")
-
-    result = tm.execute_command(session_id, 'echo $TEST_VAR')
-    print(f"   Get variable - Success: {result['success']}")
-    if result['success']:
-        print(f"   Variable value: {result['stdout']}")
-
-    # Cleanup
-    print("\n6. Cleaning up...")
-    tm.close_session(session_id)
-    print("   Session closed")
-
-    print("\n✅ TerminalManager test completed!")
+    # Lines are collected and flushed before calls that print on their own
+    log = ["🧪 Testing TerminalManager with PTY support..."]
+
+    try:
+        tm = TerminalManager()
+
+        # Test 1: Create session
+        log.append("\n1. Creating terminal session...")
+        _flush(log)
+        session_id = tm.create_session()
+        log.append(f"   Session created: {session_id}")
+
+        # Test 2: Simple command
+        log.append("\n2. Testing simple command (ls)...")
+        result = tm.execute_command(session_id, 'ls')
+        log.append(f"   Success: {result['success']}")
+        if result['success']:
+            log.append(f"   Output: {result['stdout'][:200]}...")
+        else:
+            log.append(f"   Error: {result['error']}")
+        _flush(log)
+
+        # Test 3: Change directory
+        log.append("\n3. Testing cd command...")
+        result = tm.execute_command(session_id, 'cd ~')
+        log.append(f"   Success: {result['success']}")
+
+        # Test 4: Check if cd persisted
+        log.append("\n4. Testing pwd after cd...")
+        result = tm.execute_command(session_id, 'pwd')
+        log.append(f"   Success: {result['success']}")
+        if result['success']:
+            log.append(f"   Current directory: {result['stdout']}")
+        else:
+            log.append(f"   Error: {result['error']}")
+        _flush(log)
+
+        # Test 5: Environment variable
+        log.append("\n5. Testing environment variable...")
+        result = tm.execute_command(session_id, 'export TEST_VAR=hello')
+        log.append(f"   Set variable - Success: {result['success']}")
+
+        result = tm.execute_command(session_id, 'echo $TEST_VAR')
+        log.append(f"   Get variable - Success: {result['success']}")
+        if result['success']:
+            log.append(f"   Variable value: {result['stdout']}")
+
+        # Cleanup
+        log.append("\n6. Cleaning up...")
+        _flush(log)
+        tm.close_session(session_id)
+        tm.shutdown()
+        log.append("   Session closed")
+
+        log.append("\n✅ TerminalManager test completed!")
+    finally:
+        # Don't lose the lines of a step that raised
+        _flush(log)
 
 
 if __name__ == "__main__":